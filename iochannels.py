@@ -12,13 +12,16 @@ Licensed under the MIT License. For more, see the LICENSE file.
 Author: Jake Hartz <jake@hartz.io>
 """
 
+import collections
 import contextlib
+import functools
+import re
 import shutil
 import sys
 import threading
 import time
 from enum import Enum
-from typing import Callable, Generator, List, Optional, Sequence, Sized, TextIO, Tuple, Union
+from typing import Callable, Dict, Generator, List, Optional, Sequence, Sized, TextIO, Tuple, Union
 
 
 DEFAULT_BAD_CHOICE_MSG = "Invalid choice: {}"
@@ -45,6 +48,8 @@ class Msg(Sized):
 
     PartProcessor = Callable[[PartType, str], str]
 
+    __slots__ = ("_parts", "_sep", "_end", "_len", "_cached_plain")
+
     def __init__(self, sep: str = " ", end: str = "\n") -> None:
         """
         Initialize a new message.
@@ -55,35 +60,71 @@ class Msg(Sized):
         self._parts = []  # type: List[Tuple[Msg.PartType, str]]
         self._sep = sep  # type: str
         self._end = end  # type: str
+        # The length of get_string() without a part processor, kept up to date as parts are added
+        self._len = len(end)  # type: int
+        # The result of get_string() without a part processor (reset whenever a part is added)
+        self._cached_plain = None  # type: Optional[str]
 
     def add(self, part_type: "Msg.PartType", base: str = "", *args: object) -> "Msg":
-        base = base or ""
-        self._parts.append((part_type, str(base).format(*args)))
+        """
+        Add a part to this message.
+
+        :param part_type: The type of the part.
+        :param base: The text of the part. If any args are provided, this is used as a str.format
+            template for them; otherwise, it is used as-is.
+        :return: This message (so calls can be chained).
+        """
+        if not base:
+            return self._add_part(part_type, "")
+        if not args:
+            return self._add_part(part_type, base if isinstance(base, str) else str(base))
+        return self._add_part(part_type, str(base).format(*args))
+
+    def _add_part(self, part_type: "Msg.PartType", part_str: str) -> "Msg":
+        """
+        Add a part that has already been formatted.
+        """
+        if self._parts:
+            self._len += len(self._sep)
+        self._len += len(part_str)
+        self._parts.append((part_type, part_str))
+        self._cached_plain = None
         return self
 
+    def _add_msg(self, msg: "Msg") -> "Msg":
+        """
+        Add all the parts of another message, including its separators and end string (which are
+        added as PRINT parts). This is only useful if this message's separator is empty.
+        """
+        for index, (part_type, part_str) in enumerate(msg._parts):
+            if index > 0:
+                self._add_part(_PT_PRINT, msg._sep)
+            self._add_part(part_type, part_str)
+        return self._add_part(_PT_PRINT, msg._end)
+
     def print(self, base: str = "", *args: object) -> "Msg":
-        return self.add(Msg.PartType.PRINT, base, *args)
+        return self.add(_PT_PRINT, base, *args)
 
     def status(self, base: str, *args: object) -> "Msg":
-        return self.add(Msg.PartType.STATUS, base, *args)
+        return self.add(_PT_STATUS, base, *args)
 
     def error(self, base: str, *args: object) -> "Msg":
-        return self.add(Msg.PartType.ERROR, base, *args)
+        return self.add(_PT_ERROR, base, *args)
 
     def accent(self, base: str, *args: object) -> "Msg":
-        return self.add(Msg.PartType.ACCENT, base, *args)
+        return self.add(_PT_ACCENT, base, *args)
 
     def bright(self, base: str, *args: object) -> "Msg":
-        return self.add(Msg.PartType.BRIGHT, base, *args)
+        return self.add(_PT_BRIGHT, base, *args)
 
     def bg_happy(self, base: str, *args: object) -> "Msg":
-        return self.add(Msg.PartType.BG_HAPPY, base, *args)
+        return self.add(_PT_BG_HAPPY, base, *args)
 
     def bg_sad(self, base: str, *args: object) -> "Msg":
-        return self.add(Msg.PartType.BG_SAD, base, *args)
+        return self.add(_PT_BG_SAD, base, *args)
 
     def bg_meh(self, base: str, *args: object) -> "Msg":
-        return self.add(Msg.PartType.BG_MEH, base, *args)
+        return self.add(_PT_BG_MEH, base, *args)
 
     def get_string(self, part_processor: PartProcessor = None) -> str:
         """
@@ -95,54 +136,82 @@ class Msg(Sized):
         :return: The result of processing all the parts with the part_processor.
         """
         if not part_processor:
-            part_processor = lambda _, s: s
-        return self._sep.join(part_processor(part_type, part_str)
-                              for part_type, part_str in self._parts) + self._end
+            if self._cached_plain is None:
+                self._cached_plain = self._sep.join(part_str for _, part_str in self._parts) + \
+                    self._end
+            return self._cached_plain
+        return self._sep.join([part_processor(part_type, part_str)
+                               for part_type, part_str in self._parts]) + self._end
 
     def __len__(self) -> int:
         """
         Get the length of this message when viewed as just plain, unformatted characters.
         """
-        return len(self.get_string())
+        return self._len
+
+
+# Module-level aliases for the part types, to skip the attribute lookups in frequently-called code
+_PT_PROMPT_QUESTION = Msg.PartType.PROMPT_QUESTION
+_PT_PROMPT_ANSWER = Msg.PartType.PROMPT_ANSWER
+_PT_PRINT = Msg.PartType.PRINT
+_PT_STATUS = Msg.PartType.STATUS
+_PT_ERROR = Msg.PartType.ERROR
+_PT_ACCENT = Msg.PartType.ACCENT
+_PT_BRIGHT = Msg.PartType.BRIGHT
+_PT_BG_HAPPY = Msg.PartType.BG_HAPPY
+_PT_BG_SAD = Msg.PartType.BG_SAD
+_PT_BG_MEH = Msg.PartType.BG_MEH
 
+# A message consisting of just a newline. This is shared, so it must never be added to!
+_EMPTY_NEWLINE_MSG = Msg().print()
 
-class _HTMLTransforms:
-    """Helpers for html_part_processor"""
 
-    @staticmethod
-    def _wrap_fg_color(color: str, s: str) -> str:
-        return '<span style="color: {}; font-weight: bold;">{}</span>'.format(color, s)
+_HTML_ESCAPE_TABLE = str.maketrans({
+    "&": "&amp;",
+    "\"": "&quot;",
+    "'": "&apos;",
+    "<": "&lt;",
+    ">": "&gt;"
+})
+_HTML_NEEDS_ESCAPE_RE = re.compile("[&\"'<>]")
 
-    @staticmethod
-    def _wrap_bg_color(color: str, s: str) -> str:
-        return '<span style="background-color: {}; font-weight: bold;">{}</span>'.format(color, s)
 
-    @staticmethod
-    def _wrap_bold(s: str) -> str:
-        return '<b>{}</b>'.format(s)
+def _escape_html(text: str) -> str:
+    # Most text doesn't have anything to escape, so don't bother making a copy of it
+    if _HTML_NEEDS_ESCAPE_RE.search(text) is None:
+        return text
+    return text.translate(_HTML_ESCAPE_TABLE)
 
-    @staticmethod
-    def _wrap_italic(s: str) -> str:
-        return '<i>{}</i>'.format(s)
 
-    transforms_by_part_type = {
-        Msg.PartType.PROMPT_QUESTION: lambda s: _HTMLTransforms._wrap_fg_color("#34E2E2", s),
-        Msg.PartType.PROMPT_ANSWER:   lambda s: _HTMLTransforms._wrap_italic(s),
+# The HTML to put before and after each type of part
+_HTML_WRAPS = {
+    Msg.PartType.PROMPT_QUESTION: ('<span style="color: #34E2E2; font-weight: bold;">',
+                                   '</span>'),
+    Msg.PartType.PROMPT_ANSWER:   ('<i>', '</i>'),
 
-        Msg.PartType.PRINT:    lambda s: s,
-        Msg.PartType.STATUS:   lambda s: _HTMLTransforms._wrap_fg_color("#8AE234", s),
-        Msg.PartType.ERROR:    lambda s: _HTMLTransforms._wrap_fg_color("#EF2929", s),
-        Msg.PartType.ACCENT:   lambda s: _HTMLTransforms._wrap_fg_color("#729FCF", s),
-        Msg.PartType.BRIGHT:   lambda s: _HTMLTransforms._wrap_bold(s),
-        Msg.PartType.BG_HAPPY: lambda s: _HTMLTransforms._wrap_bg_color("green", s),
-        Msg.PartType.BG_SAD:   lambda s: _HTMLTransforms._wrap_bg_color("red", s),
-        Msg.PartType.BG_MEH:   lambda s: _HTMLTransforms._wrap_bg_color("blue", s)
-    }
+    Msg.PartType.PRINT:    ('', ''),
+    Msg.PartType.STATUS:   ('<span style="color: #8AE234; font-weight: bold;">', '</span>'),
+    Msg.PartType.ERROR:    ('<span style="color: #EF2929; font-weight: bold;">', '</span>'),
+    Msg.PartType.ACCENT:   ('<span style="color: #729FCF; font-weight: bold;">', '</span>'),
+    Msg.PartType.BRIGHT:   ('<b>', '</b>'),
+    Msg.PartType.BG_HAPPY: ('<span style="background-color: green; font-weight: bold;">',
+                            '</span>'),
+    Msg.PartType.BG_SAD:   ('<span style="background-color: red; font-weight: bold;">',
+                            '</span>'),
+    Msg.PartType.BG_MEH:   ('<span style="background-color: blue; font-weight: bold;">',
+                            '</span>')
+}  # type: Dict[Msg.PartType, Tuple[str, str]]
 
-    @staticmethod
-    def escape_html(text: str) -> str:
-        return text.replace("&", "&amp;").replace("\"", "&quot;").replace("'", "&apos;") \
-                   .replace("<", "&lt;").replace(">", "&gt;")
+
+def _render_html_part(part_type: Msg.PartType, part_str: str) -> str:
+    prefix, suffix = _HTML_WRAPS.get(part_type, ("", ""))
+    return prefix + _escape_html(part_str) + suffix
+
+
+# Logs tend to repeat the same short parts (prompts, status words, etc.) over and over, so those are
+# cached. Longer parts are usually unique, and caching them would just keep them alive.
+_HTML_CACHED_PART_MAX_LEN = 64
+_render_short_html_part = functools.lru_cache(maxsize=4096)(_render_html_part)
 
 
 def html_part_processor(part_type: Msg.PartType, part_str: str) -> str:
@@ -150,10 +219,21 @@ def html_part_processor(part_type: Msg.PartType, part_str: str) -> str:
     A part processor (see Msg::get_string) that generates HTML. It's expected that the HTML content
     will be embedded inside <pre></pre> tags.
     """
-    html_part_str = _HTMLTransforms.escape_html(part_str)
-    if part_type is not None:
-        html_part_str = _HTMLTransforms.transforms_by_part_type[part_type](html_part_str)
-    return html_part_str
+    if len(part_str) <= _HTML_CACHED_PART_MAX_LEN:
+        return _render_short_html_part(part_type, part_str)
+    return _render_html_part(part_type, part_str)
+
+
+class _NoLock:
+    """
+    Stand-in for a threading.Lock that doesn't actually lock anything.
+    """
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info: object) -> None:
+        pass
 
 
 class Log:
@@ -221,22 +301,20 @@ class Log:
 
     def output(self, msg: Msg) -> None:
         """
-        Append a message to the log.
+        Append a message to the log. The output may be buffered until the log is flushed or closed.
         """
-        if not self._closed:
-            with self._lock:
-                if not self._closed and self._enabled:
-                    self._write(msg)
-                    self._flush()
+        with self._lock:
+            if self._closed or not self._enabled:
+                return
+            self._write(msg)
 
     def flush(self) -> None:
         """
         Flush any buffered output.
         """
-        if not self._closed:
-            with self._lock:
-                if not self._closed:
-                    self._flush()
+        with self._lock:
+            if not self._closed:
+                self._flush()
 
     def close(self) -> None:
         """
@@ -290,31 +368,83 @@ class MemoryLog(Log):
     Log implementation that stores a log in memory.
     """
 
-    def __init__(self, part_processor: Msg.PartProcessor = None) -> None:
+    def __init__(self, part_processor: Msg.PartProcessor = None, batch: bool = False,
+                 thread_safe: bool = True) -> None:
+        """
+        Initialize a new memory log.
+
+        :param part_processor: A part processor (see Msg::get_string) used to render messages.
+        :param batch: Whether to batch up output instead of taking the lock for every message.
+            Batched output is moved into the log whenever it is flushed or read. Messages that are
+            output at the same time as the log is closed are dropped.
+        :param thread_safe: Whether to lock around writes. This can be turned off if the log will
+            only ever be written to by a single Channel (which already serializes its output).
+        """
         super().__init__()
+        if not thread_safe:
+            self._lock = _NoLock()
         self._part_processor = part_processor
-        self._content = ""
+        # Content is kept as a list of strings and only joined when it's read
+        self._content = []  # type: List[str]
+        # Rendered messages that haven't been moved into _content yet (only used if batching)
+        self._pending = collections.deque() if batch else None  # type: Optional[collections.deque]
 
     def __getstate__(self) -> dict:
         state = super().__getstate__()
-        state["content"] = self._content
+        with self._lock:
+            state["content"] = self._join_content()
         # When we read this state back, we won't be able to write to the log anymore,
         # so there's no point storing the part_processor function.
         return state
 
     def __setstate__(self, state: dict) -> None:
         super().__setstate__(state)
-        self._content = state["content"]
+        self._content = [state["content"]]
 
     def _write(self, msg: Msg) -> None:
-        self._content += msg.get_string(self._part_processor)
+        self._content.append(msg.get_string(self._part_processor))
+
+    def _flush(self) -> None:
+        if self._pending:
+            # deque.popleft is atomic, so this is safe while other threads are still appending
+            pending = self._pending
+            content = self._content
+            try:
+                while True:
+                    content.append(pending.popleft())
+            except IndexError:
+                pass
+
+    def _close(self) -> None:
+        if self._pending is not None:
+            # Swap in a deque that discards anything appended to it, so any output that races with
+            # close() (and lands after the final flush) never makes it into the closed log
+            self._pending = collections.deque(maxlen=0)
+
+    def output(self, msg: Msg) -> None:
+        if self._pending is None:
+            super().output(msg)
+        elif self._enabled:
+            # deque.append is atomic, so we don't bother acquiring the lock (once the log is closed,
+            # _pending discards everything)
+            self._pending.append(msg.get_string(self._part_processor))
+
+    def _join_content(self) -> str:
+        """
+        Join all the content into one string, which replaces the individual pieces so the next read
+        doesn't have to join them again. The lock must be held when calling this.
+        """
+        self._flush()
+        if len(self._content) != 1:
+            self._content[:] = ["".join(self._content)]
+        return self._content[0]
 
     def get_content(self) -> str:
         """
         Read all the content in the log.
         """
         with self._lock:
-            return self._content
+            return self._join_content()
 
 
 class HTMLMemoryLog(MemoryLog):
@@ -322,12 +452,12 @@ class HTMLMemoryLog(MemoryLog):
     MemoryLog subclass that renders the log as HTML.
     """
 
-    def __init__(self) -> None:
-        super().__init__(html_part_processor)
+    def __init__(self, batch: bool = False, thread_safe: bool = True) -> None:
+        super().__init__(html_part_processor, batch=batch, thread_safe=thread_safe)
 
     def get_content(self) -> str:
         with self._lock:
-            return '<pre>' + self._content + '</pre>'
+            return '<pre>' + self._join_content() + '</pre>'
 
 
 class FileLog(Log):
@@ -335,13 +465,26 @@ class FileLog(Log):
     Log implementation that logs to a file.
     """
 
-    def __init__(self, file: TextIO, part_processor: Msg.PartProcessor = None) -> None:
+    def __init__(self, file: TextIO, part_processor: Msg.PartProcessor = None,
+                 flush_per_write: bool = False) -> None:
+        """
+        Initialize a new file log.
+
+        :param file: The file to write to.
+        :param part_processor: A part processor (see Msg::get_string) used to render messages.
+        :param flush_per_write: Whether to flush the file after every message. Otherwise, output
+            is only flushed when Log::flush or Log::close is called (or when the file's buffer
+            fills up).
+        """
         super().__init__()
         self._file = file
         self._part_processor = part_processor
+        self._flush_per_write = flush_per_write
 
     def _write(self, msg: Msg) -> None:
         self._file.write(msg.get_string(self._part_processor))
+        if self._flush_per_write:
+            self._file.flush()
 
     def _flush(self) -> None:
         self._file.flush()
@@ -355,8 +498,8 @@ class HTMLFileLog(FileLog):
     FileLog subclass that renders the log as HTML.
     """
 
-    def __init__(self, file: TextIO) -> None:
-        super().__init__(file, html_part_processor)
+    def __init__(self, file: TextIO, flush_per_write: bool = False) -> None:
+        super().__init__(file, html_part_processor, flush_per_write=flush_per_write)
         file.write('\n\n<pre style="background-color: black; color: white;">\n')
 
     def _close(self) -> None:
@@ -364,6 +507,38 @@ class HTMLFileLog(FileLog):
         super()._close()
 
 
+class _WaitInLine:
+    """
+    Context manager returned by Channel::_wait_in_line. This is a plain class, rather than a
+    contextlib.contextmanager generator, since it's entered for every single Channel I/O call.
+    """
+
+    __slots__ = ("_channel",)
+
+    def __init__(self, channel: "Channel") -> None:
+        self._channel = channel
+
+    def __enter__(self) -> None:
+        channel = self._channel
+        me = threading.get_ident()
+        if me == channel._current_thread_id:
+            raise Channel.ChannelStateError(
+                "The current thread already has a blocking lock on all I/O! Did you call a "
+                "Channel method from within a blocking_io context? (See the Channel.blocking_io "
+                "docs for more.)")
+        # The lock is held until the end of the "with" block, so any other threads just wait here
+        channel._lock.acquire()
+        if channel._closed:
+            channel._lock.release()
+            raise Channel.ChannelStateError("Channel is already closed")
+        channel._current_thread_id = me
+
+    def __exit__(self, *exc_info: object) -> None:
+        channel = self._channel
+        channel._current_thread_id = None
+        channel._lock.release()
+
+
 class Channel:
     """
     Abstract class that provides methods to get input from the user and give output back to the
@@ -383,12 +558,15 @@ class Channel:
         pass
 
     def __init__(self, *delegates: Log) -> None:
-        self._delegates = set(delegates)
+        # A tuple (rather than a set) since this is iterated over for every message but rarely
+        # changed; dict.fromkeys removes any duplicates
+        self._delegates = tuple(dict.fromkeys(delegates))  # type: Tuple[Log, ...]
         self._lock = threading.Lock()
-        self._cv = threading.Condition(self._lock)
-        self._line = []  # type: List[threading.Thread]
-        self._current_thread = None  # type: Optional[threading.Thread]
+        # The thread doing I/O, as identified by threading.get_ident() (which is cheaper than
+        # threading.current_thread())
+        self._current_thread_id = None  # type: Optional[int]
         self._closed = False
+        self._turn = _WaitInLine(self)
 
     def _out(self, msg: Msg) -> None:
         """
@@ -405,6 +583,13 @@ class Channel:
         """
         raise NotImplementedError()
 
+    def _flush(self) -> None:
+        """
+        See Channel::flush. This method should be overridden in subclasses to flush output, if
+        necessary.
+        """
+        pass
+
     def _close(self) -> None:
         """
         See Channel::close. This method should be overridden in subclasses to close any open
@@ -423,27 +608,12 @@ class Channel:
         """
         return None, None
 
-    @contextlib.contextmanager
-    def _wait_in_line(self) -> Generator[None, None, None]:
-        me = threading.current_thread()
-        if me == self._current_thread:
-            raise Channel.ChannelStateError(
-                "The current thread already has a blocking lock on all I/O! Did you call a "
-                "Channel method from within a blocking_io context? (See the Channel.blocking_io "
-                "docs for more.)")
-        with self._lock:
-            self._line.append(me)
-            self._cv.wait_for(lambda: self._line[0] == me, None)
-
-            assert self._line.pop(0) == me
-            if self._closed:
-                raise Channel.ChannelStateError("Channel is already closed")
-            try:
-                self._current_thread = me
-                yield
-            finally:
-                self._current_thread = None
-                self._cv.notify_all()
+    def _wait_in_line(self) -> "_WaitInLine":
+        """
+        Get a context manager that waits until it's the current thread's turn to do I/O, and keeps
+        everyone else waiting until the end of the "with" block.
+        """
+        return self._turn
 
     def add_delegate(self, *delegates: Log) -> None:
         """
@@ -451,14 +621,14 @@ class Channel:
         messages, but will not be backfilled with previous messages.
         """
         with self._wait_in_line():
-            self._delegates |= set(delegates)
+            self._delegates = tuple(dict.fromkeys(self._delegates + delegates))
 
     def remove_delegate(self, *delegates: Log) -> None:
         """
         Remove one or more delegates from this channel.
         """
         with self._wait_in_line():
-            self._delegates -= set(delegates)
+            self._delegates = tuple(d for d in self._delegates if d not in delegates)
 
     def close(self) -> None:
         """
@@ -470,8 +640,18 @@ class Channel:
             self._closed = True
             for delegate in self._delegates:
                 delegate.close()
+            self._flush()
             self._close()
 
+    def flush(self) -> None:
+        """
+        Flush any buffered output (from this channel and any delegates).
+        """
+        with self._wait_in_line():
+            self._flush()
+            for delegate in self._delegates:
+                delegate.flush()
+
     def _message_delegates_nosync(self, msg: Msg) -> None:
         for delegate in self._delegates:
             delegate.output(msg)
@@ -481,7 +661,8 @@ class Channel:
         See Channel::output.
         """
         self._out(msg)
-        self._message_delegates_nosync(msg)
+        if self._delegates:
+            self._message_delegates_nosync(msg)
 
     def _input_nosync(self, prompt: str = None,
                       autocomplete_choices: Union[str, Sequence[str]] = None) -> Optional[str]:
@@ -490,13 +671,16 @@ class Channel:
         """
         msg = None
         if prompt is not None:
-            msg = Msg(end=" ").add(Msg.PartType.PROMPT_QUESTION, prompt)
-            self._message_delegates_nosync(msg)
+            msg = Msg(end=" ").add(_PT_PROMPT_QUESTION, prompt)
+            if self._delegates:
+                self._message_delegates_nosync(msg)
         line = self._in(msg, autocomplete_choices)
-        if line is None:
-            self._message_delegates_nosync(Msg().print())
-        else:
-            self._message_delegates_nosync(Msg().add(Msg.PartType.PROMPT_ANSWER, line))
+        # Don't bother building the echo message if nobody is going to receive it
+        if self._delegates:
+            if line is None:
+                self._message_delegates_nosync(_EMPTY_NEWLINE_MSG)
+            else:
+                self._message_delegates_nosync(Msg().add(_PT_PROMPT_ANSWER, line))
         return line
 
     def _prompt_nosync(self, prompt: str, choices: Sequence[str], default_choice: str = None,
@@ -506,24 +690,15 @@ class Channel:
         """
         See Channel::prompt.
         """
-        our_choices = []
-        user_choices = ""
-        has_empty_choice = False
-
-        for c in choices:
-            if c == "":
-                has_empty_choice = True
-            else:
-                our_choices.append(c.lower())
-                if hidden_choices is None or c not in hidden_choices:
-                    user_choices += c + "/"
+        hidden = frozenset(hidden_choices or ())
+        our_choices = {c.lower() for c in choices if c != ""}
+        visible_choices = [c for c in choices if c != "" and c not in hidden]
+        has_empty_choice = "" in choices
 
         if has_empty_choice:
             # We add in this choice last
-            user_choices += "Enter"
-        else:
-            # Strip trailing slash
-            user_choices = user_choices[:-1]
+            visible_choices.append("Enter")
+        user_choices = "/".join(visible_choices)
 
         msg = prompt
         if show_choices:
@@ -653,34 +828,41 @@ class Channel:
             with self._wait_in_line():
                 for msg in msgs:
                     self._output_nosync(msg)
-                    self._output_nosync(Msg().print())
+                    self._output_nosync(_EMPTY_NEWLINE_MSG)
             return
 
+        # Messages are laid out in column-major order, "num_rows" messages per column
+        lengths = [len(msg) for msg in msgs]
+
+        def fits(num_rows: int) -> bool:
+            total_width = 0
+            for start in range(0, len(lengths), num_rows):
+                total_width += max(lengths[start:start + num_rows]) + len(prefix)
+                if total_width >= num_cols:
+                    return False
+            return True
+
         # Keep trying, until we can fit everything into "num_rows" rows, or each message is in its
         # own row
         for num_rows in range(1, len(msgs) + 1):
-            cols = []
-            msgs_left = msgs
-            while len(msgs_left) > 0:
-                cols.append(msgs_left[0:num_rows])
-                msgs_left = msgs_left[num_rows:]
-            col_lengths = [max(len(msg) for msg in col) for col in cols]
-            total_width = sum(col_lengths) + len(cols) * len(prefix)
-            if total_width < num_cols:
+            if fits(num_rows):
                 break
+        col_lengths = [max(lengths[start:start + num_rows])
+                       for start in range(0, len(lengths), num_rows)]
 
-        # Transform from column-major to row-major for printing
+        # Transform from column-major to row-major for printing, outputting each row as one message
         with self._wait_in_line():
             for row_index in range(num_rows):
-                for col_index in range(len(cols)):
-                    if row_index < len(cols[col_index]):
-                        msg = cols[col_index][row_index]
-                        self._output_nosync(Msg(end="").print(prefix))
-                        self._output_nosync(msg)
+                row = Msg(sep="")
+                for col_index in range(len(col_lengths)):
+                    msg_index = col_index * num_rows + row_index
+                    if msg_index < len(msgs):
+                        msg = msgs[msg_index]
+                        row._add_part(_PT_PRINT, prefix)
+                        row._add_msg(msg)
                         if len(msg) < col_lengths[col_index]:
-                            self._output_nosync(
-                                Msg(end="").print(" " * (col_lengths[col_index] - len(msg))))
-                self._output_nosync(Msg().print())
+                            row._add_part(_PT_PRINT, " " * (col_lengths[col_index] - len(msg)))
+                self._output_nosync(row)
 
     def print(self, base: str = "", *args: object, **kwargs: str) -> None:
         """Shortcut for output(Msg(...).print(...))"""
@@ -689,18 +871,19 @@ class Channel:
     def print_bordered(self, base: str, *args: object,
                        type: Msg.PartType = Msg.PartType.PRINT) -> None:
         """
-        Print a bordered message.
+        Print a bordered message. Like Msg::add, base is only used as a str.format template if any
+        args are provided.
         """
-        message = base.format(*args)
+        message = base.format(*args) if args else base
         cols, _ = self.get_window_size()
         lines = []
         for line in message.splitlines():
             if not cols:
                 lines.append(line)
             else:
-                while line:
-                    lines.append(line[:cols-4])
-                    line = line[cols-4:]
+                # Blank lines are kept as-is (like when we don't know the window size)
+                width = cols - 4
+                lines.extend([line[i:i+width] for i in range(0, len(line), width)] or [""])
         max_len = max((len(line) for line in lines), default=0)
         if cols:
             cols = min(cols, max_len + 4)
@@ -711,11 +894,13 @@ class Channel:
         start_padding = (available_width - max_len) // 2
         line_width = available_width - start_padding
 
+        border = "*" * cols
+        line_start = "* " + " " * start_padding
         msg = Msg(sep="\n")
-        msg.add(type, "{}", "*" * cols)
+        msg.add(type, border)
         for line in lines:
-            msg.add(type, "* {}{} *", " " * start_padding, line.ljust(line_width))
-        msg.add(type, "{}", "*" * cols)
+            msg.add(type, line_start + line.ljust(line_width) + " *")
+        msg.add(type, border)
         self.output(msg)
 
     def status(self, base: str, *args: object, **kwargs: str) -> None:
@@ -769,12 +954,21 @@ class CLIChannel(Channel):
     "readline" for autocompletion if available.
     """
 
+    # How long (in seconds) to remember the terminal size before checking it again
+    _WINDOW_SIZE_TTL = 0.25
+
     def __init__(self, *delegates: Log, use_readline: bool = True) -> None:
         super().__init__(*delegates)
+        self._window_size = (None, None)  # type: Tuple[Optional[int], Optional[int]]
+        self._window_size_expiration = 0.0  # type: float
+        # The stream that sys.stdout was the last time we wrote to it, and whether it's a terminal
+        # (sys.stdout can be replaced at any time, e.g. by contextlib.redirect_stdout)
+        self._stdout = None  # type: Optional[TextIO]
+        self._stdout_is_tty = False
 
         if use_readline:
             from support import readline_support
-            self._readline_completer = readline_support.global_readline_completer
+            self._readline_completer = readline_support.get_completer()
         else:
             self._readline_completer = None
 
@@ -786,8 +980,22 @@ class CLIChannel(Channel):
                 self._readline_completer.set_options(options)
 
     def _out(self, msg: Msg) -> None:
-        print(self._msg_to_string(msg), end="")
-        sys.stdout.flush()
+        stdout = sys.stdout
+        if stdout is None:
+            # There's nowhere to print to (e.g. under pythonw), so just drop the output like print()
+            return
+        if stdout is not self._stdout:
+            self._stdout = stdout
+            self._stdout_is_tty = stdout.isatty()
+
+        text = self._msg_to_string(msg)
+        stdout.write(text)
+        # On a terminal, complete lines are flushed by the line buffering, but anything else needs
+        # to be flushed explicitly so the user can see it. When output is going somewhere else
+        # (like a pipe), it's left buffered until Channel::flush is called or the buffer fills up.
+        # (Prompts are always visible, since input() flushes stdout before reading.)
+        if self._stdout_is_tty and not text.endswith("\n"):
+            stdout.flush()
 
     def _in(self, prompt_msg: Msg = None,
             autocomplete_choices: Union[str, Sequence[str]] = None) -> Optional[str]:
@@ -809,8 +1017,16 @@ class CLIChannel(Channel):
     def _msg_to_string(self, msg: Msg) -> str:
         return msg.get_string()
 
+    def _flush(self) -> None:
+        if sys.stdout is not None:
+            sys.stdout.flush()
+
     def get_window_size(self) -> Tuple[Optional[int], Optional[int]]:
-        return shutil.get_terminal_size()
+        now = time.monotonic()
+        if now >= self._window_size_expiration:
+            self._window_size = shutil.get_terminal_size()
+            self._window_size_expiration = now + CLIChannel._WINDOW_SIZE_TTL
+        return self._window_size
 
 
 class ColorCLIChannel(CLIChannel):
@@ -818,47 +1034,49 @@ class ColorCLIChannel(CLIChannel):
     A subclass of CLIChannel that prints messages in color.
     """
 
-    def _wrap_bright(self, s: str) -> str:
-        return "{}{}{}".format(self._colorama.Style.BRIGHT, s, self._colorama.Style.NORMAL)
+    def _bright_codes(self) -> Tuple[str, str]:
+        return self._colorama.Style.BRIGHT, self._colorama.Style.NORMAL
 
-    def _wrap_fg_color(self, color: str, s: str) -> str:
-        return "{}{}{}".format(getattr(self._colorama.Fore, color),
-                               self._wrap_bright(s),
-                               self._colorama.Fore.RESET)
+    def _fg_color_codes(self, color: str) -> Tuple[str, str]:
+        prefix, suffix = self._bright_codes()
+        return getattr(self._colorama.Fore, color) + prefix, suffix + self._colorama.Fore.RESET
 
-    def _wrap_bg_color(self, color: str, s: str) -> str:
-        return "{}{}{}".format(getattr(self._colorama.Back, color),
-                               self._wrap_fg_color("WHITE", s),
-                               self._colorama.Back.RESET)
+    def _bg_color_codes(self, color: str) -> Tuple[str, str]:
+        prefix, suffix = self._fg_color_codes("WHITE")
+        return getattr(self._colorama.Back, color) + prefix, suffix + self._colorama.Back.RESET
 
     def __init__(self, *delegates: Log, use_readline: bool = True,
                  application_name_for_error: str = None) -> None:
         super().__init__(*delegates, use_readline=use_readline)
 
         from support import colorama_support
-        self._colorama = colorama_support.colorama
+        self._colorama = colorama_support.ensure_colorama()
 
         if self._colorama:
-            self._transforms_by_part_type = {
-                Msg.PartType.PROMPT_QUESTION: lambda s: self._wrap_fg_color("CYAN", s),
-                Msg.PartType.PROMPT_ANSWER:   lambda s: s,
-
-                Msg.PartType.PRINT:    lambda s: s,
-                Msg.PartType.STATUS:   lambda s: self._wrap_fg_color("GREEN", s),
-                Msg.PartType.ERROR:    lambda s: self._wrap_fg_color("RED", s),
-                Msg.PartType.ACCENT:   lambda s: self._wrap_fg_color("BLUE", s),
-                Msg.PartType.BRIGHT:   lambda s: self._wrap_bright(s),
-                Msg.PartType.BG_HAPPY: lambda s: self._wrap_bg_color("GREEN", s),
-                Msg.PartType.BG_SAD:   lambda s: self._wrap_bg_color("RED", s),
-                Msg.PartType.BG_MEH:   lambda s: self._wrap_bg_color("BLUE", s)
-            }
+            # The escape codes to put before and after each type of part (looked up once here,
+            # rather than every time a part is rendered)
+            self._codes_by_part_type = {
+                Msg.PartType.PROMPT_QUESTION: self._fg_color_codes("CYAN"),
+                Msg.PartType.PROMPT_ANSWER:   ("", ""),
+
+                Msg.PartType.PRINT:    ("", ""),
+                Msg.PartType.STATUS:   self._fg_color_codes("GREEN"),
+                Msg.PartType.ERROR:    self._fg_color_codes("RED"),
+                Msg.PartType.ACCENT:   self._fg_color_codes("BLUE"),
+                Msg.PartType.BRIGHT:   self._bright_codes(),
+                Msg.PartType.BG_HAPPY: self._bg_color_codes("GREEN"),
+                Msg.PartType.BG_SAD:   self._bg_color_codes("RED"),
+                Msg.PartType.BG_MEH:   self._bg_color_codes("BLUE")
+            }  # type: Dict[Msg.PartType, Tuple[str, str]]
 
             # There's an issue with colorama on Windows (since Python 3.5) where it won't color
             # properly when using the input() function:
             # https://github.com/tartley/colorama/issues/103
             # So, until that's fixed, we won't color prompt questions.
             if colorama_support.is_colorama_on_windows:
-                self._transforms_by_part_type[Msg.PartType.PROMPT_QUESTION] = lambda s: s
+                self._codes_by_part_type[Msg.PartType.PROMPT_QUESTION] = ("", "")
+
+            self._part_processor = self._make_part_processor()
         else:
             # The default functionality will just fall back to boring ol' black-and-white
             self.print()
@@ -867,9 +1085,17 @@ class ColorCLIChannel(CLIChannel):
                        application_name_for_error or "Output")
             self.print()
 
+    def _make_part_processor(self) -> Msg.PartProcessor:
+        codes_by_part_type = self._codes_by_part_type
+
+        def part_processor(part_type: Msg.PartType, part_str: str) -> str:
+            prefix, suffix = codes_by_part_type[part_type]
+            return prefix + part_str + suffix
+
+        return part_processor
+
     def _msg_to_string(self, msg: Msg) -> str:
         if self._colorama is None:
             return super()._msg_to_string(msg)
 
-        return msg.get_string(lambda part_type, part_str:
-                              self._transforms_by_part_type[part_type](part_str))
+        return msg.get_string(self._part_processor)
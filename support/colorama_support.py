@@ -1,22 +1,44 @@
 """
 Initialize colorama support.
 
-NOTE: colorama will be initialized as soon as this module is imported for the first time, so don't
-import it unless you KNOW you want colorama!
+NOTE: colorama isn't imported or initialized until ensure_colorama() is called for the first time,
+so importing this module by itself doesn't wrap stdout/stderr.
 
 Licensed under the MIT License. For more, see the LICENSE file.
 
 Author: Jake Hartz <jake@hartz.io>
 """
 
+import threading
+from types import ModuleType
+from typing import Optional
+
+colorama = None  # type: Optional[ModuleType]
 is_colorama_on_windows = False
 
-try:
-    import colorama
-    colorama.init()
+_initialized = False
+_init_lock = threading.Lock()
+
+
+def ensure_colorama() -> Optional[ModuleType]:
+    """
+    Import and initialize colorama, if that hasn't been done yet. After this is called, the
+    "colorama" and "is_colorama_on_windows" module variables are set.
+
+    :return: The colorama module, or None if it's not available.
+    """
+    global colorama, is_colorama_on_windows, _initialized
+    with _init_lock:
+        if not _initialized:
+            _initialized = True
+            try:
+                import colorama as _colorama
+            except ImportError:
+                return None
+            _colorama.init()
 
-    if hasattr(colorama, "win32") and hasattr(colorama.win32, "winapi_test") and \
-            colorama.win32.winapi_test():
-        is_colorama_on_windows = True
-except ImportError:
-    colorama = None
+            if hasattr(_colorama, "win32") and hasattr(_colorama.win32, "winapi_test") and \
+                    _colorama.win32.winapi_test():
+                is_colorama_on_windows = True
+            colorama = _colorama
+    return colorama
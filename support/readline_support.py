@@ -1,8 +1,8 @@
 """
 Initialize readline support.
 
-NOTE: readline will be initialized as soon as this module is imported for the first time, so don't
-import it unless you KNOW you want readline!
+NOTE: readline isn't imported or initialized until get_completer() is called for the first time, so
+importing this module by itself doesn't affect input().
 
 Licensed under the MIT License. For more, see the LICENSE file.
 
@@ -10,6 +10,8 @@ Author: Jake Hartz <jake@hartz.io>
 """
 
 import atexit
+import bisect
+import threading
 from typing import Callable, List, Optional, Sequence, cast
 
 
@@ -31,21 +33,36 @@ class InputCompleter:
 
     def __init__(self) -> None:
         self.options = None  # type: Optional[List[str]]
+        # A sorted copy of "options" (without any empty options) for finding matches quickly
+        self._sorted_options = None  # type: Optional[List[str]]
         self.matches = None  # type: Optional[List[str]]
+        # The text that "matches" was found for
+        self._matches_text = None  # type: Optional[str]
 
         self.single_option = None  # type: Optional[str]
 
+        # The method that __call__ uses, picked whenever the options are set so we don't have to
+        # figure it out on every call
+        self._impl = self._insert_tab  # type: Callable[[str, int], Optional[str]]
+
     def set_options(self, options: Optional[Sequence[str]]) -> None:
+        if options is not None:
+            _register_atexit()
         self.options = options
+        self._sorted_options = sorted(s for s in options if s) if options is not None else None
         self.matches = None
 
         self.single_option = None
+        self._impl = self._get_option if options is not None else self._insert_tab
 
     def set_single_option(self, option: str) -> None:
+        _register_atexit()
         self.options = None
+        self._sorted_options = None
         self.matches = None
 
         self.single_option = option
+        self._impl = self._get_single_option if option is not None else self._insert_tab
 
     def __call__(self, text: str, state: int) -> Optional[str]:
         """
@@ -55,40 +72,76 @@ class InputCompleter:
         :param state: The index of the item in the results list.
         :return: The item matched by text and state, or None.
         """
-        if self.options is not None:
-            return self._get_option(text, state)
-        elif self.single_option is not None:
-            return self._get_single_option(text, state)
-        else:
-            # readline not currently turned on; maybe the user actually wants a tab character
-            if state == 0:
-                _readline.insert_text("\t")
-                _readline.redisplay()
-                return ""
+        return self._impl(text, state)
+
+    def _insert_tab(self, text: str, state: int) -> Optional[str]:
+        # readline not currently turned on; maybe the user actually wants a tab character
+        if state == 0:
+            _readline.insert_text("\t")
+            _readline.redisplay()
+            return ""
+        return None
 
     def _get_option(self, text: str, state: int) -> Optional[str]:
-        if not text.strip():
-            return None
-
-        if state == 0 or self.matches is None:
-            self.matches = [s for s in self.options if s and s.startswith(text)]
-
-        try:
-            return self.matches[state]
-        except IndexError:
-            return None
+        # readline asks for each state in turn, and the user may hit TAB repeatedly on the same
+        # text, so only look for matches again if the text changed
+        matches = self.matches
+        if matches is None or text != self._matches_text:
+            if not text.strip():
+                return None
+
+            # All the options starting with "text" are next to each other in the sorted list,
+            # starting where "text" would be inserted
+            options = self._sorted_options
+            start = end = bisect.bisect_left(options, text)
+            while end < len(options) and options[end].startswith(text):
+                end += 1
+            matches = self.matches = options[start:end]
+            self._matches_text = text
+
+        return matches[state] if state < len(matches) else None
 
     def _get_single_option(self, text: str, state: int) -> Optional[str]:
         if state == 0 and self.single_option.startswith(text):
             return self.single_option
         return None
 
-try:
-    import readline as _readline
-    global_readline_completer = InputCompleter()  # type: Optional[InputCompleter]
-    _readline.set_completer(cast(Callable[[str, int], str], global_readline_completer))
-    _readline.parse_and_bind("tab: complete")
-    atexit.register(lambda: _readline.set_completer(None))
-except ImportError:
-    _readline = None
-    global_readline_completer = None
+_readline = None
+global_readline_completer = None  # type: Optional[InputCompleter]
+
+_initialized = False
+_init_lock = threading.Lock()
+_atexit_registered = False
+
+
+def _register_atexit() -> None:
+    """
+    Make sure our completer is removed from readline when the interpreter exits. This is only done
+    once there's actually something to autocomplete.
+    """
+    global _atexit_registered
+    if not _atexit_registered and _readline is not None:
+        _atexit_registered = True
+        atexit.register(lambda: _readline.set_completer(None))
+
+
+def get_completer() -> Optional[InputCompleter]:
+    """
+    Import and set up readline (if that hasn't been done yet), and get the InputCompleter that it
+    uses for autocompletion.
+
+    :return: The global InputCompleter, or None if readline is not available.
+    """
+    global _readline, global_readline_completer, _initialized
+    with _init_lock:
+        if not _initialized:
+            _initialized = True
+            try:
+                import readline
+            except ImportError:
+                return None
+            _readline = readline
+            global_readline_completer = InputCompleter()
+            _readline.set_completer(cast(Callable[[str, int], str], global_readline_completer))
+            _readline.parse_and_bind("tab: complete")
+    return global_readline_completer